@@ -6,21 +6,32 @@ import numpy as np
 
 class PhysarumAgent(Subject, Agent):
     """ Agent class for the Physarum simulation."""
-    def __init__(self, x, y, angle):
+    def __init__(self, x, y, angle, species=0, weights=None, sensor_distance=None, move_distance=None):
         super().__init__()
-        
+        self.reset(x, y, angle, species, weights, sensor_distance, move_distance)
+
+        print(f'Creating agent at ({x}, {y}) with angle {angle}')
+        print(f'Agent {self} moving {self.move_distance} units with sensor distance {self.sensor_distance}')
+
+    def reset(self, x, y, angle, species=0, weights=None, sensor_distance=None, move_distance=None):
+        """
+        Put the agent back into its initial state at a new position, keeping its observers.
+        Sensor and move distances are drawn at random unless given, see `random_distances`.
+        """
         self.x = int(x)  # Make sure this is an integer
         self.y = int(y)  # Make sure this is an integer
         self.angle = float(angle)  # Make sure this is a float
+        self.species = int(species)  # Trail channel this agent deposits into
+        # Attraction/repulsion weight of each trail channel when sensing
+        self.weights = np.ones(1) if weights is None else weights
         self.state = SearchState()
         self.grid_size = Config.GRID_SIZE
 
         # Assign random values for sensor and move distance for each agent
-        self.sensor_distance = np.random.uniform(low=2.0, high=8.0)  # Adjust range as needed
-        self.move_distance = np.random.uniform(low=2.0, high=4.0)  # Adjust range as needed
-
-        print(f'Creating agent at ({x}, {y}) with angle {angle}')
-        print(f'Agent {self} moving {self.move_distance} units with sensor distance {self.sensor_distance}')
+        if sensor_distance is None or move_distance is None:
+            sensor_distance, move_distance = random_distances()
+        self.sensor_distance = float(sensor_distance)
+        self.move_distance = float(move_distance)
 
     def sense_and_move(self, grid):
         x = float(self.x)
@@ -45,10 +56,10 @@ class PhysarumAgent(Subject, Agent):
         right_sensor = ((int(x + np.cos(angle + sensor_angle) * sensor_distance) % grid_size[0]),
                         (int(y + np.sin(angle + sensor_angle) * sensor_distance) % grid_size[1]))
 
-        # Get the food concentration at sensor points
-        left_val = grid[left_sensor]
-        front_val = grid[front_sensor]
-        right_val = grid[right_sensor]
+        # Get the weighted food concentration over all channels at sensor points
+        left_val = self._sense(grid, left_sensor)
+        front_val = self._sense(grid, front_sensor)
+        right_val = self._sense(grid, right_sensor)
 
         # Determine the new angle based on sensor readings
         self._update_angle(left_val, front_val, right_val, sensor_angle)
@@ -65,6 +76,10 @@ class PhysarumAgent(Subject, Agent):
         # Notify observers about the move
         self.notify_observers({'agent': self, 'x': self.x, 'y': self.y, 'state': self.state})
 
+    def _sense(self, grid, sensor):
+        # Read every channel at the sensor point at once and weight it by species
+        return np.dot(self.weights, grid[:, sensor[0], sensor[1]])
+
     def _update_angle(self, left_val, front_val, right_val, sensor_angle):
         # Move towards the direction with highest food concentration
         if left_val > right_val and left_val > front_val:
@@ -79,7 +94,7 @@ class PhysarumAgent(Subject, Agent):
 
     def _leave_trail(self, grid, food_value):
         # Increase the value at the current grid position to leave a trail
-        grid[self.x, self.y] += food_value
+        grid[self.species, self.x, self.y] += food_value
         self.notify_observers({'agent': self, 'x': self.x, 'y': self.y, 'state': self.state})
 
     def _bounce_on_wall(self, grid_size):
@@ -102,7 +117,25 @@ class PhysarumAgent(Subject, Agent):
         self.notify_observers({'agent': self})
 
 
+def random_distances(count=None):
+    """ Random sensor and move distances, for one agent or as arrays for `count` agents. """
+    sensor_distance = np.random.uniform(low=2.0, high=8.0, size=count)  # Adjust range as needed
+    move_distance = np.random.uniform(low=2.0, high=4.0, size=count)  # Adjust range as needed
+    return sensor_distance, move_distance
+
+
+def default_species_weights(species_count, repulsion):
+    """ Weight matrix where each species follows its own trail and avoids the others. """
+    weights = np.full((species_count, species_count), -float(repulsion))
+    np.fill_diagonal(weights, 1.0)
+    return weights
+
+
 class PhysarumAgentFactory(AgentFactory):
     """ Factory class for creating Physarum agents. """
-    def create_agent(self, x, y, angle):
-        return PhysarumAgent(x, y, angle)
\ No newline at end of file
+    def __init__(self, species_weights=None):
+        self.species_weights = species_weights
+
+    def create_agent(self, x, y, angle, species=0, sensor_distance=None, move_distance=None):
+        weights = None if self.species_weights is None else self.species_weights[species]
+        return PhysarumAgent(x, y, angle, species, weights, sensor_distance, move_distance)
@@ -4,6 +4,8 @@ PI = 3.14159
 class Config:
     DECAY = 0.45 # Decay rate of the chemotrails
     DIFFUSION = 0.4 # Diffusion rate of the chemotrails
+    DIFFUSION_MODE = 'stencil' # Diffusion engine: 'stencil' (exact), 'fft' (exact, any pass count) or 'pyramid' (approximate coarse grid blur)
+    DIFFUSION_PASSES = 1 # Stencil passes of decay and diffusion per step, large counts give wide diffusion
     SENSOR_ANGLE = PI / 8 # Angle between each sensor
     SENSOR_DISTANCE = 3 # Distance to sense for food sources
     MOVE_DISTANCE = 2 # Distance to move forward each step
@@ -21,10 +23,32 @@ class Config:
     AGENT_DEFAULT_COLOR = (255, 255, 255)
     AGENT_SEARCH_COLOR = (255, 0, 0)
     AGENT_FEED_COLOR = (0, 255, 0)
-    MAX_TRAIL_VALUE = 1 # Maximum value of a cell in the grid
-    TRAIL_VALUE = 1 # Amount of trail to add when an agent moves
+    MAX_TRAIL_VALUE = 1.0 # Maximum value of a cell in the grid
+    TRAIL_VALUE = 1.0 # Amount of trail to add when an agent moves
     CLEAR_RADIUS = 5 # Radius within which chemotrails are cleared
     FRAMERATE = 60 # Framerate of the visualization
+    WINDOW_SIZE = (900, 900) # Largest window size in pixels, bigger grids are viewed through a pan/zoom viewport
+    ZOOM_STEP = 1.25 # Zoom factor per mouse wheel notch
+    PAN_STEP = 40 # Distance in pixels to pan per arrow key press
+    LOD_REDUCTION = 'max' # Mipmap reduction used when zoomed out: 'min', 'max' or 'mean' ('max' keeps thin trails visible)
+    LOD_REFRESH_INTERVAL = 4 # Frames after which the coarse mipmap levels are out of date and refreshed again
+    LOD_REFRESH_BUDGET = 1 # Grid cells of the coarse mipmap levels refreshed per frame, in multiples of the window area
+    GRID_BACKING_FILE = None # Path prefix of memory-mapped files holding the trail grid, None keeps the grid in memory
+    TILE_SIZE = 256 # Size in cells of the square tiles of a memory-mapped grid, must divide GRID_SIZE
+    TILE_CACHE_SIZE = 64 # Number of tiles of a memory-mapped grid kept in memory
+    HISTORY_ENABLED = None # Record a rewindable history of the grid and agents, None records it only in the GUI on in-memory grids
+    HISTORY_BUDGET_MB = 64 # Memory budget of the history, least recently used segments are evicted beyond it
+    HISTORY_KEYFRAME_INTERVAL = 50 # Steps between full keyframes of the history
+    HISTORY_TILE_SIZE = 32 # Size in cells of the tiles compared and stored by the history
+    HISTORY_TOLERANCE = 1e-3 # Largest change of a tile that is not stored in the history
+    CONTROL_STREAM_INTERVAL = 1.0 # Seconds between metrics lines streamed by the control endpoint
+    CHECKPOINT_PATH = 'checkpoint_{step}.npz' # Default checkpoint file of the control endpoint, {step} is the step count
+    SNAPSHOT_PATH = 'snapshot_{step}.npy' # Default snapshot file of the control endpoint
+    SPECIES_COUNT = 1 # Number of species, each with its own trail channel in the grid
+    SPECIES_WEIGHTS = None # (species x species) attraction (+) / repulsion (-) weights used when sensing, or (species x channels) to also weight the food channel, None for the default below
+    SPECIES_REPULSION = 0.5 # Repulsion from the trails of other species when SPECIES_WEIGHTS is None
+    SPECIES_COLORS = [(253, 231, 36), (240, 80, 60), (80, 160, 255), (250, 250, 250)] # Trail colors per channel, channel 0 uses the 'viridis' colormap
+    FOOD_COLOR = (120, 255, 120) # Color of the food channel, used when there is more than one species
 
 
 
@@ -0,0 +1,157 @@
+# control.py :
+from config import Config
+import asyncio
+import json
+import threading
+
+
+class ControlServer:
+    """
+    Local HTTP endpoint to watch and steer a running simulation, served by an asyncio
+    loop on a background thread. It listens on 127.0.0.1:`port` or on the Unix socket
+    `socket_path`, and only reads the metrics the simulation publishes after each step
+    or queues work to run between steps, so it never holds up the simulation thread.
+
+        GET  /metrics     latest metrics as JSON
+        GET  /stream      one JSON line of metrics every CONTROL_STREAM_INTERVAL seconds
+        GET  /params      current Config values
+        POST /params      JSON object of Config values, applied together between two steps
+                          (400 without applying any if one does not fit its current type,
+                          or is a count of agents or food, which only a reset places)
+        POST /reset       restart the simulation, optional JSON body {"seed": ..., "params": {...}}
+        POST /checkpoint  save a checkpoint, optional JSON body {"path": ...}
+        POST /snapshot    save the trail grid, optional JSON body {"path": ...}
+    """
+    def __init__(self, simulation, port=None, socket_path=None, host='127.0.0.1'):
+        if (port is None) == (socket_path is None):
+            raise ValueError('Give either a port or a socket path')
+        self.simulation = simulation
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self._loop = None
+        self._stopped = None
+        self._clients = set()  # Tasks handling open connections, cancelled on stop
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True)
+        self._routes = {
+            ('GET', '/metrics'): self._get_metrics,
+            ('GET', '/params'): self._get_params,
+            ('POST', '/params'): self._post_params,
+            ('POST', '/reset'): self._post_reset,
+            ('POST', '/checkpoint'): self._post_checkpoint,
+            ('POST', '/snapshot'): self._post_snapshot,
+        }
+
+    def start(self):
+        """ Start serving in the background, returns once the endpoint accepts connections. """
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """ Stop serving, requests still waiting for a step fail and their connections are closed. """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        if self.socket_path is not None:
+            server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        else:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+            self.port = server.sockets[0].getsockname()[1]  # The actual port when 0 was asked for
+        self._started.set()
+        async with server:
+            await self._stopped.wait()
+            # The step loop may be gone, so do not wait for requests queued between steps
+            for task in self._clients:
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        self._clients.add(asyncio.current_task())
+        try:
+            method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = {}
+            while (line := (await reader.readline()).decode('latin-1').strip()):
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            payload = json.loads(body) if body else {}
+
+            if (method, path) == ('GET', '/stream'):
+                await self._stream_metrics(writer)
+                return
+            route = self._routes.get((method, path))
+            if route is None:
+                await self._respond(writer, 404, {'error': f'No route for {method} {path}'})
+            else:
+                await self._respond(writer, 200, await route(payload))
+        except ValueError as error:
+            await self._respond(writer, 400, {'error': str(error)})
+        except ConnectionError:
+            pass  # The client went away
+        except asyncio.CancelledError:
+            # Cancelled by stop() while waiting for a step that may never come
+            await self._respond(writer, 503, {'error': 'The control server stopped before the request ran'})
+        except Exception as error:
+            await self._respond(writer, 500, {'error': str(error)})
+        finally:
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload, default=str).encode()
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error',
+                  503: 'Service Unavailable'}[status]
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+
+    async def _stream_metrics(self, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+        try:
+            while not self._stopped.is_set():
+                writer.write(json.dumps(self.simulation.metrics).encode() + b'\n')
+                await writer.drain()
+                await asyncio.sleep(Config.CONTROL_STREAM_INTERVAL)
+        except asyncio.CancelledError:
+            pass  # Stopped, the stream simply ends
+
+    async def _get_metrics(self, payload):
+        return self.simulation.metrics
+
+    async def _get_params(self, payload):
+        return {name: getattr(Config, name) for name in vars(Config) if name.isupper()}
+
+    async def _post_params(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError('Expected a JSON object of parameter values')
+        applied = await asyncio.wrap_future(self.simulation.set_params(payload))
+        return {'applied': applied, 'step': self.simulation.step_count}
+
+    async def _post_reset(self, payload):
+        if not isinstance(payload, dict) or not isinstance(payload.get('params', {}), dict):
+            raise ValueError('Expected a JSON object with an optional seed and an object of parameter values')
+        seed, params = payload.get('seed'), payload.get('params')
+        if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+            raise ValueError(f'seed must be an integer, got {seed!r}')
+        await asyncio.wrap_future(self.simulation.call_between_steps(self.simulation.reset, seed, params))
+        return {'reset': True, 'step': self.simulation.step_count}
+
+    async def _post_checkpoint(self, payload):
+        return {'path': await self._save(self.simulation.save_checkpoint, payload, Config.CHECKPOINT_PATH)}
+
+    async def _post_snapshot(self, payload):
+        return {'path': await self._save(self.simulation.save_snapshot, payload, Config.SNAPSHOT_PATH)}
+
+    async def _save(self, save, payload, default_path):
+        """ Copy the state between steps, then wait for it to be written off the simulation thread. """
+        if not isinstance(payload, dict) or not isinstance(payload.get('path', ''), str):
+            raise ValueError('Expected a JSON object with an optional path string')
+        path = payload.get('path') or default_path.format(step=self.simulation.step_count)
+        written = await asyncio.wrap_future(self.simulation.call_between_steps(save, path))
+        return await asyncio.wrap_future(written)
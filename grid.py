@@ -1,14 +1,306 @@
 from patterns import GridBuilder
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numba
 import numpy as np
 
 class PhysarumGridBuilder(GridBuilder):
     """ Grid builder class for the Physarum simulation."""
     def __init__(self):
         self.grid = None
+        self.width = None
+        self.height = None
+        self.channels = None
+        self.backing_file = None
+        self.tile_size = None
+        self.cache_tiles = None
 
     def set_dimensions(self, width, height):
-        self.grid = np.zeros((width, height))
+        self.width = width
+        self.height = height
+        return self
+
+    def set_channels(self, channels):
+        """ Use a (channels, width, height) layout with one trail channel per species. """
+        self.channels = channels
+        return self
+
+    def set_backing_file(self, path, tile_size, cache_tiles):
+        """ Keep the grid tile by tile in memory-mapped files at `path` instead of in RAM. """
+        self.backing_file = path
+        self.tile_size = tile_size
+        self.cache_tiles = cache_tiles
         return self
 
     def build(self):
-        return self.grid
\ No newline at end of file
+        if self.backing_file is not None:
+            self.grid = MappedGrid(self.backing_file, self.channels or 1, self.width, self.height,
+                                   self.tile_size, self.cache_tiles)
+        elif self.channels is None:
+            self.grid = np.zeros((self.width, self.height))
+        else:
+            self.grid = np.zeros((self.channels, self.width, self.height))
+        return self.grid
+
+
+class MappedGrid:
+    """
+    (channels, width, height) trail grid stored tile by tile in memory-mapped files.
+    Indexing works like a NumPy array with integers and contiguous slices, going
+    through an LRU cache of tiles that only writes dirty tiles back to disk.
+    """
+    def __init__(self, path, channels, width, height, tile_size, cache_tiles):
+        if width % tile_size or height % tile_size or tile_size % 2:
+            raise ValueError(f'Grid size ({width}, {height}) must be a multiple of the even tile size {tile_size}')
+        self.path = path  # Prefix of the backing files, derived files such as mipmap levels share it
+        self.shape = (channels, width, height)
+        self.ndim = 3
+        self.tile_size = tile_size
+        self.tiles_shape = (width // tile_size, height // tile_size)
+        self.cache_tiles = max(cache_tiles, 9)  # At least a tile and its neighbours
+
+        # Two tile stores, diffusion streams from the front one into the back one and swaps them
+        store_shape = self.tiles_shape + (channels, tile_size, tile_size)
+        self._stores = [np.memmap(f'{path}.{k}', dtype=np.float64, mode='w+', shape=store_shape) for k in range(2)]
+        self._active = [np.zeros(self.tiles_shape, dtype=bool) for _ in range(2)]  # Tiles that may hold trail
+        self._front = 0
+
+        self._cache = OrderedDict()
+        self._dirty = set()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def __getitem__(self, key):
+        channel_key, (x0, x1, y0, y1), squeeze = self._parse_key(key)
+        return self._read_region(x0, x1, y0, y1)[(channel_key,) + squeeze]
+
+    def __setitem__(self, key, value):
+        channel_key, (x0, x1, y0, y1), squeeze = self._parse_key(key)
+        region = self._read_region(x0, x1, y0, y1)
+        region[(channel_key,) + squeeze] = value
+        self._write_region(x0, y0, region)
+
+    def _parse_key(self, key):
+        # Split an index into the channel part, the covered cells and how to drop integer axes
+        if not isinstance(key, tuple):
+            key = (key,)
+        channel_key, x_key, y_key = key + (slice(None),) * (3 - len(key))
+        bounds = []
+        squeeze = []
+        for k, size in ((x_key, self.shape[1]), (y_key, self.shape[2])):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(size)
+                if step != 1:
+                    raise IndexError('MappedGrid only supports contiguous slices')
+                bounds += [start, max(start, stop)]
+                squeeze.append(slice(None))
+            else:
+                i = int(k) + size if int(k) < 0 else int(k)
+                if not 0 <= i < size:
+                    raise IndexError(f'Index {k} is out of bounds for size {size}')
+                bounds += [i, i + 1]
+                squeeze.append(0)
+        return channel_key, bounds, tuple(squeeze)
+
+    def _overlapping_tiles(self, x0, x1, y0, y1):
+        # Yield each tile touching the region with the matching slices of the tile and of the region
+        t = self.tile_size
+        for tx in range(x0 // t, (x1 - 1) // t + 1):
+            for ty in range(y0 // t, (y1 - 1) // t + 1):
+                ax0, ax1 = max(x0, tx * t), min(x1, (tx + 1) * t)
+                ay0, ay1 = max(y0, ty * t), min(y1, (ty + 1) * t)
+                yield ((tx, ty), (slice(None), slice(ax0 - tx * t, ax1 - tx * t), slice(ay0 - ty * t, ay1 - ty * t)),
+                       (slice(None), slice(ax0 - x0, ax1 - x0), slice(ay0 - y0, ay1 - y0)))
+
+    def _read_region(self, x0, x1, y0, y1):
+        region = np.empty((self.shape[0], x1 - x0, y1 - y0))
+        for key, tile_slice, region_slice in self._overlapping_tiles(x0, x1, y0, y1):
+            region[region_slice] = self._tile(*key)[tile_slice]
+        return region
+
+    def _write_region(self, x0, y0, region):
+        x1, y1 = x0 + region.shape[1], y0 + region.shape[2]
+        for key, tile_slice, region_slice in self._overlapping_tiles(x0, x1, y0, y1):
+            self._tile(*key)[tile_slice] = region[region_slice]
+            self._dirty.add(key)
+            self._active[self._front][key] = True
+
+    def _read_tile(self, tx, ty):
+        # Inactive tiles are known to be zero and are never read from disk
+        if not self._active[self._front][tx, ty]:
+            return np.zeros(self._stores[0].shape[2:])
+        return np.array(self._stores[self._front][tx, ty])
+
+    def _tile(self, tx, ty):
+        key = (tx, ty)
+        tile = self._cache.get(key)
+        if tile is not None:
+            self._cache.move_to_end(key)
+            return tile
+        future = self._pending.pop(key, None)
+        tile = future.result() if future is not None else self._read_tile(tx, ty)
+        self._cache[key] = tile
+        while len(self._cache) > self.cache_tiles:
+            old_key, old_tile = self._cache.popitem(last=False)
+            if old_key in self._dirty:
+                self._stores[self._front][old_key] = old_tile
+                self._dirty.discard(old_key)
+        return tile
+
+    def prefetch(self, tiles):
+        """ Start reading tiles in the background so that they are cached when needed. """
+        for key in tiles:
+            if key not in self._cache and key not in self._pending:
+                self._pending[key] = self._executor.submit(self._read_tile, *key)
+
+    def stream_agents(self, agents):
+        """
+        Yield agents in their own order, which decides the result just like on an in-memory
+        grid and is sorted by tile each step. Whenever the tile changes from one agent to the
+        next, the tiles around the tile of the following run of agents are prefetched.
+        """
+        keys = [(agent.x // self.tile_size, agent.y // self.tile_size) for agent in agents]
+        # Index of the first agent of each run of agents in the same tile
+        starts = [k for k in range(len(keys)) if k == 0 or keys[k] != keys[k - 1]]
+        runs = dict(zip(starts, starts[1:]))
+        for k, agent in enumerate(agents):
+            if k in runs:
+                self.prefetch(self._neighbourhood(*keys[runs[k]]))
+            yield agent
+
+    def _neighbourhood(self, tx, ty):
+        return [((tx + dx) % self.tiles_shape[0], (ty + dy) % self.tiles_shape[1])
+                for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+    def flush(self):
+        """ Write the dirty cached tiles back to disk. """
+        for key in self._dirty:
+            self._stores[self._front][key] = self._cache[key]
+        self._dirty.clear()
+
+    def fill(self, value):
+        """ Set every cell to `value`, like numpy.ndarray.fill, without reallocating the files. """
+        for future in self._pending.values():
+            future.result()
+        self._pending.clear()
+        self._cache.clear()
+        self._dirty.clear()
+        for store, active in zip(self._stores, self._active):
+            if value == 0:
+                # Only tiles that may hold trail need to be written
+                for tx, ty in zip(*np.nonzero(active)):
+                    store[tx, ty] = 0
+                active[:] = False
+            else:
+                store[...] = value
+                active[:] = True
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown()
+        for store in self._stores:
+            store.flush()
+
+    def decay_and_diffuse(self, decay, diffusion, cell_size):
+        """
+        Apply decay and diffusion tile by tile, streaming rows of tiles from the front
+        store into the back store. Gives the same result as the in-memory kernel.
+        """
+        self.flush()
+        for future in self._pending.values():
+            future.result()
+        self._pending.clear()
+        self._cache.clear()
+
+        source, target = self._stores[self._front], self._stores[1 - self._front]
+        source_active, target_active = self._active[self._front], self._active[1 - self._front]
+        tiles_x = self.tiles_shape[0]
+
+        # A tile can only hold trail after this step if it or one of its neighbours does now
+        needed = np.zeros_like(source_active)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                needed |= np.roll(source_active, (dx, dy), axis=(0, 1))
+
+        rows = {}
+        def load_row(tx):
+            tx %= tiles_x
+            if tx not in rows:
+                rows[tx] = self._executor.submit(self._read_row, source, source_active, tx)
+            return rows[tx]
+
+        zeros = np.zeros(source.shape[2:])
+        padded = np.zeros((self.shape[0], self.tile_size + 2, self.tile_size + 2))
+        result = np.empty(source.shape[2:])
+        for tx in range(tiles_x):
+            load_row(tx + 2)  # Prefetch the row needed after this one
+            above, here, below = (load_row(tx + d).result() for d in (-1, 0, 1))
+            for ty in range(self.tiles_shape[1]):
+                if needed[tx, ty]:
+                    self._fill_padded(padded, above, here, below, ty, zeros)
+                    _decay_and_diffuse_padded(padded, result, decay, diffusion, cell_size)
+                    target[tx, ty] = result
+                    target_active[tx, ty] = True
+                elif target_active[tx, ty]:
+                    # Only clear tiles that still hold trail from two steps ago
+                    target[tx, ty] = 0
+                    target_active[tx, ty] = False
+            # Keep the first and last rows around for the wrap-around at the end
+            if (tx - 1) % tiles_x not in (0, tiles_x - 1):
+                rows.pop((tx - 1) % tiles_x, None)
+
+        self._front = 1 - self._front
+
+    def _read_row(self, store, active, tx):
+        return [np.array(store[tx, ty]) if active[tx, ty] else None for ty in range(self.tiles_shape[1])]
+
+    @staticmethod
+    def _fill_padded(padded, above, here, below, ty, zeros):
+        # Copy a tile and a one cell border from its neighbours (wrapping around) into `padded`
+        def tile(row, j):
+            t = row[j % len(row)]
+            return zeros if t is None else t
+        padded[:, 1:-1, 1:-1] = tile(here, ty)
+        padded[:, 0, 1:-1] = tile(above, ty)[:, -1, :]
+        padded[:, -1, 1:-1] = tile(below, ty)[:, 0, :]
+        padded[:, 1:-1, 0] = tile(here, ty - 1)[:, :, -1]
+        padded[:, 1:-1, -1] = tile(here, ty + 1)[:, :, 0]
+        padded[:, 0, 0] = tile(above, ty - 1)[:, -1, -1]
+        padded[:, 0, -1] = tile(above, ty + 1)[:, -1, 0]
+        padded[:, -1, 0] = tile(below, ty - 1)[:, 0, -1]
+        padded[:, -1, -1] = tile(below, ty + 1)[:, 0, 0]
+
+    def iter_tiles(self):
+        """ Yield (x0, y0, tile) for every tile, reading straight from disk. """
+        self.flush()
+        for tx in range(self.tiles_shape[0]):
+            for ty in range(self.tiles_shape[1]):
+                yield tx * self.tile_size, ty * self.tile_size, self._read_tile(tx, ty)
+
+
+def iter_tiles(grid, tile_size):
+    """ Yield (x0, y0, tile) over an in-memory or memory-mapped (channels, width, height) grid. """
+    if isinstance(grid, MappedGrid):
+        yield from grid.iter_tiles()
+        return
+    for x0 in range(0, grid.shape[1], tile_size):
+        for y0 in range(0, grid.shape[2], tile_size):
+            yield x0, y0, grid[:, x0:x0 + tile_size, y0:y0 + tile_size]
+
+
+@numba.jit(nopython=True, cache=True)
+def _decay_and_diffuse_padded(padded, result, decay, diffusion, cell_size):
+    """ Apply decay and diffusion to a tile surrounded by a one cell border. """
+    for c in range(result.shape[0]):
+        for i in range(result.shape[1]):
+            for j in range(result.shape[2]):
+                # Apply decay
+                value = padded[c, i + 1, j + 1] * (1 - decay)
+
+                # Apply diffusion
+                for di in [-1, 0, 1]:
+                    for dj in [-1, 0, 1]:
+                        if di == 0 and dj == 0:
+                            continue
+                        value += padded[c, i + 1 + di, j + 1 + dj] * diffusion / cell_size
+                result[c, i, j] = value
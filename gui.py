@@ -1,10 +1,12 @@
-from PyQt6.QtWidgets import QApplication, QMainWindow, QSlider, QVBoxLayout, QWidget, QLabel
+# gui.py :
+from PyQt6.QtWidgets import QApplication, QMainWindow, QSlider, QVBoxLayout, QWidget, QLabel, QPushButton
 from PyQt6.QtCore import Qt, QTimer
 from PyQt6 import QtGui
 from PyQt6.QtGui import QImage, QPixmap, QPainter
-
-import pygame
 import sys
+import pygame
+from config import Config
+from grid import MappedGrid
 
 class ImageWidget(QWidget):
     def __init__(self,surface,parent=None):
@@ -38,35 +40,109 @@ class SliderWidget(QWidget):
     def value_changed(self,value):
         self.label.setText(self.name+": "+str(value))
 
+class ButtonWidget(QWidget):
+    def __init__(self, name, callback, parent=None):
+        super(ButtonWidget, self).__init__(parent)
+        self.name = name
+        self.button = QPushButton(self.name)
+        self.button.clicked.connect(callback)  # Connect to the provided callback
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.button)
+        self.setLayout(self.layout)
+
 class MainWindow(QMainWindow):
-    def __init__(self,surface,parent=None):
-        super(MainWindow,self).__init__(parent)
-        self.setCentralWidget(ImageWidget(surface))
-        self.slider_decay=SliderWidget(Qt.Orientation.Horizontal,"Decay")
-        self.slider_diffusion=SliderWidget(Qt.Orientation.Horizontal,"Diffusion")
-        self.slider_decay.slider.setValue(50)
-        self.slider_diffusion.slider.setValue(50)
-        self.slider_decay.slider.valueChanged.connect(self.update_decay)
-        self.slider_diffusion.slider.valueChanged.connect(self.update_diffusion)
-        self.layout=QVBoxLayout()
-        self.layout.addWidget(self.slider_decay)
-        self.layout.addWidget(self.slider_diffusion)
-        self.centralWidget().setLayout(self.layout)
+    def __init__(self, simulation, parent=None):
+        super(MainWindow, self).__init__(parent)
+        self.simulation = simulation
+        self.image_widget = ImageWidget(simulation.renderer.window)
+        self.setCentralWidget(self.image_widget)
+        self.init_ui()
+
+    def init_ui(self):
+        self.slider_decay = SliderWidget(Qt.Orientation.Horizontal, "Decay")
+        self.slider_diffusion = SliderWidget(Qt.Orientation.Horizontal, "Diffusion")
+
+        # Set initial slider values based on simulation config
+        self.slider_decay.slider.setValue(int(Config.DECAY * 100))
+        self.slider_diffusion.slider.setValue(int(Config.DIFFUSION * 100))
+
+        # Connect sliders to the simulation parameter update methods
+        self.slider_decay.slider.valueChanged.connect(self.simulation.update_decay)
+        self.slider_diffusion.slider.valueChanged.connect(self.simulation.update_diffusion)
+
+        # Timeline slider to scrub back through the recorded history and a button to return to the live view
+        self.live = True
+        self.slider_history = SliderWidget(Qt.Orientation.Horizontal, "Step")
+        self.slider_history.slider.sliderMoved.connect(self.scrub_history)
+        self.live_button = ButtonWidget("Live", self.resume_live)
+
+        # Add a restart button
+        self.restart_button = ButtonWidget("Restart Simulation", self.restart_simulation)
+
+        # Add an exit button
+        self.exit_button = ButtonWidget("Exit Application", self.quit_apps)
+
+        # Arrange widgets in the layout
+        layout = QVBoxLayout()
+        layout.addWidget(self.slider_decay)
+        layout.addWidget(self.slider_diffusion)
+        if self.simulation.history is not None:
+            layout.addWidget(self.slider_history)
+            layout.addWidget(self.live_button)
+        layout.addWidget(self.restart_button)
+        layout.addWidget(self.exit_button)
+        self.centralWidget().setLayout(layout)
+
+        # Timer to update the Pygame simulation
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_simulation)
+        self.timer.start(1000 // Config.FRAMERATE)  # Update as per simulation frame rate
+
+    def update_simulation(self):
+        # Code to update simulation and Pygame display, paused while scrubbing the history
+        if not self.live:
+            return
+        self.simulation.run_step()  
+        self.image_widget.update()  # Refresh the PyQt6 widget displaying the Pygame surface
+
+        # Keep the timeline covering the steps still held by the history
+        history = self.simulation.history
+        if history is not None:
+            self.slider_history.slider.setRange(history.first_step, history.last_step)
+            self.slider_history.slider.setValue(history.last_step)
+
+    def scrub_history(self, step):
+        """ Pauses the simulation and shows the recorded state of a past step. """
+        self.live = False
+        try:
+            self.simulation.show_history(step)
+        except KeyError:
+            return  # The step has been evicted from the history
+        self.image_widget.update()
 
-    def update_decay(self,value):
-        print("Decay: "+str(value))
+    def resume_live(self):
+        """ Returns from the history to the running simulation. """
+        self.live = True
 
-    def update_diffusion(self,value):
-        print("Diffusion: "+str(value))
+    def restart_simulation(self):
+        """ Restarts the simulation in place, keeping the window and the surface shown by the image widget. """
+        self.simulation.reset()
+        self.live = True
 
 
+    def quit_apps(self):
+        """ Quits the application. """
+        self.timer.stop()
+        pygame.quit()
+        QApplication.instance().quit()
+        sys.exit()
 
-pygame.init()
-s=pygame.Surface((640,480))
-s.fill((64,128,192,224))
-pygame.draw.circle(s,(255,255,255,255),(100,100),50)
 
-app=QApplication(sys.argv)
-w=MainWindow(s)
-w.show()
-app.exec()
\ No newline at end of file
+def run_gui(simulation):
+    """ Show the Qt window around a simulation and run the event loop, returns the exit code. """
+    app = QApplication.instance() or QApplication(sys.argv)
+    if Config.HISTORY_ENABLED is None and not isinstance(simulation.grid, MappedGrid):
+        simulation.enable_history()  # Backs the timeline slider
+    window = MainWindow(simulation)
+    window.show()
+    return app.exec()
@@ -0,0 +1,153 @@
+# history.py :
+from grid import iter_tiles
+from collections import OrderedDict
+import zlib
+import numpy as np
+
+# Agents are stored as one packed record per agent, with the angle quantized to 16 bits
+AGENT_RECORD = np.dtype([('x', '<i4'), ('y', '<i4'), ('angle', '<u2'), ('species', 'u1')])
+
+
+class GridHistory:
+    """
+    Bounded, rewindable history of the grid and the agents.
+
+    Every `keyframe_interval` steps a keyframe stores all grid tiles, the steps in
+    between only store the tiles that moved by more than `tolerance` since they were
+    last stored. Tiles are quantized to 16 bits and zlib compressed. Once the stored
+    bytes exceed `budget_bytes` whole keyframe segments are evicted, least recently
+    used first. The quantized copy of the last stored tiles, kept to detect changes,
+    counts toward the budget. A reconstructed cell is off by at most
+    `tolerance + (tile max - tile min) / 131070` from the recorded value.
+    """
+    def __init__(self, tile_size, keyframe_interval, tolerance, budget_bytes):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.tolerance = tolerance
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0  # Stored frames and the change-detection reference
+        self.shape = None
+        self._segments = OrderedDict()  # Keyframe step -> segment, least recently used first
+        self._recording = None
+        self._reference = {}  # Tile position -> (low, scale, codes) of the tile as last stored, to detect changes
+
+    @property
+    def first_step(self):
+        return min(segment.start for segment in self._segments.values())
+
+    @property
+    def last_step(self):
+        return self._recording.frames[-1].step
+
+    def clear(self):
+        self._segments.clear()
+        self._recording = None
+        self._reference.clear()
+        self.nbytes = 0
+
+    def _clear_reference(self):
+        self.nbytes -= sum(codes.nbytes for _, _, codes in self._reference.values())
+        self._reference.clear()
+
+    def record(self, step, grid, agents):
+        """ Store the grid and the agent arrays (x, y, angle, species) of a step. """
+        if self._recording is None or step - self._recording.start >= self.keyframe_interval:
+            self._recording = _Segment(step)
+            self._segments[step] = self._recording
+            self._clear_reference()  # Forces every tile into the keyframe
+        self.shape = grid.shape
+
+        tiles = {}
+        for x0, y0, tile in iter_tiles(grid, self.tile_size):
+            reference = self._reference.get((x0, y0))
+            if reference is not None:
+                low, scale, codes = reference
+                if np.max(np.abs(tile - (codes * scale + low))) <= self.tolerance:
+                    continue
+                self.nbytes -= codes.nbytes
+            tiles[(x0, y0)], self._reference[(x0, y0)] = _encode_tile(tile)
+            self.nbytes += self._reference[(x0, y0)][2].nbytes
+
+        frame = _Frame(step, tiles, _encode_agents(agents))
+        self._recording.frames.append(frame)
+        self._recording.nbytes += frame.nbytes
+        self.nbytes += frame.nbytes
+        self._segments.move_to_end(self._recording.start)
+        self._evict()
+
+    def _evict(self):
+        # Drop least recently used segments, never the one being recorded
+        while self.nbytes > self.budget_bytes and len(self._segments) > 1:
+            start = next(iter(self._segments))
+            if self._segments[start] is self._recording:
+                self._segments.move_to_end(start)
+                continue
+            self.nbytes -= self._segments.pop(start).nbytes
+
+    def reconstruct(self, step, out=None):
+        """
+        Rebuild the grid of `step` into `out` (allocated if None) and return it with the
+        agent arrays. Raises KeyError if the step was never recorded or has been evicted.
+        """
+        segment = next((s for s in self._segments.values() if s.start <= step <= s.frames[-1].step), None)
+        if segment is None:
+            raise KeyError(step)
+        self._segments.move_to_end(segment.start)
+
+        frames = [frame for frame in segment.frames if frame.step <= step]
+        if frames[-1].step != step:
+            raise KeyError(step)
+
+        # Walk back to the keyframe and decode the latest stored version of every tile
+        out = np.empty(self.shape) if out is None else out
+        decoded = set()
+        for frame in reversed(frames):
+            for (x0, y0), encoded in frame.tiles.items():
+                if (x0, y0) not in decoded:
+                    tile = _decode_tile(encoded)
+                    out[:, x0:x0 + tile.shape[1], y0:y0 + tile.shape[2]] = tile
+                    decoded.add((x0, y0))
+        return out, _decode_agents(frames[-1].agents)
+
+
+class _Segment:
+    """ A keyframe and the delta frames recorded after it. """
+    def __init__(self, start):
+        self.start = start
+        self.frames = []
+        self.nbytes = 0
+
+
+class _Frame:
+    """ Compressed tiles and agents of a single step. """
+    def __init__(self, step, tiles, agents):
+        self.step = step
+        self.tiles = tiles
+        self.agents = agents
+        self.nbytes = len(agents[1]) + sum(len(encoded[3]) for encoded in tiles.values())
+
+
+def _encode_tile(tile):
+    """ Quantize a tile to 16 bits, returns the compressed tile and the uncompressed (low, scale, codes). """
+    low = float(tile.min())
+    scale = (float(tile.max()) - low) / 65535 or 1.0
+    codes = np.round((tile - low) / scale).astype(np.uint16)
+    return (tile.shape, low, scale, zlib.compress(codes.tobytes(), 1)), (low, scale, codes)
+
+def _decode_tile(encoded):
+    shape, low, scale, payload = encoded
+    return np.frombuffer(zlib.decompress(payload), dtype=np.uint16).reshape(shape) * scale + low
+
+def _encode_agents(agents):
+    records = np.empty(len(agents['x']), dtype=AGENT_RECORD)
+    records['x'] = agents['x']
+    records['y'] = agents['y']
+    records['angle'] = np.round(np.mod(agents['angle'], 2 * np.pi) / (2 * np.pi) * 65535)
+    records['species'] = agents['species']
+    return len(records), zlib.compress(records.tobytes(), 1)
+
+def _decode_agents(encoded):
+    count, payload = encoded
+    records = np.frombuffer(zlib.decompress(payload), dtype=AGENT_RECORD, count=count)
+    return {'x': records['x'].astype(np.int64), 'y': records['y'].astype(np.int64),
+            'angle': records['angle'] / 65535 * 2 * np.pi, 'species': records['species'].astype(np.int64)}
@@ -1,129 +1,137 @@
-# main.py
-from PyQt6.QtWidgets import QApplication, QMainWindow, QSlider, QVBoxLayout, QWidget, QLabel, QPushButton
-from PyQt6.QtCore import Qt, QTimer
-from PyQt6 import QtGui
-from PyQt6.QtGui import QImage, QPixmap, QPainter
+# main.py :
+# Command line entry point. Only the standard library is imported up front, the
+# simulation core, Pygame and PyQt6 are imported by the subcommands that need them.
+import argparse
 import sys
-import pygame
-from simulation import PhysarumSimulation
-from config import Config
-
-class ImageWidget(QWidget):
-    def __init__(self,surface,parent=None):
-        super(ImageWidget,self).__init__(parent)
-        w=surface.get_width()
-        h=surface.get_height()
-        self.data=surface.get_buffer().raw
-        self.image=QImage(self.data,w,h,QImage.Format.Format_RGB32)
-
-    def paintEvent(self,event):
-        qp=QtGui.QPainter()
-        qp.begin(self)
-        qp.drawImage(0,0,self.image)
-        qp.end()
-
-class SliderWidget(QWidget):
-    def __init__(self,orientation,name,parent=None):
-        super(SliderWidget,self).__init__(parent)
-        self.name=name
-        self.slider=QSlider(orientation)
-        self.slider.setMinimum(0)
-        self.slider.setMaximum(100)
-        self.slider.setValue(0)
-        self.slider.valueChanged.connect(self.value_changed)
-        self.label=QLabel(self.name)
-        self.layout=QVBoxLayout()
-        self.layout.addWidget(self.label)
-        self.layout.addWidget(self.slider)
-        self.setLayout(self.layout)
-
-    def value_changed(self,value):
-        self.label.setText(self.name+": "+str(value))
-
-class ButtonWidget(QWidget):
-    def __init__(self, name, callback, parent=None):
-        super(ButtonWidget, self).__init__(parent)
-        self.name = name
-        self.button = QPushButton(self.name)
-        self.button.clicked.connect(callback)  # Connect to the provided callback
-        self.layout = QVBoxLayout()
-        self.layout.addWidget(self.button)
-        self.setLayout(self.layout)
-
-class MainWindow(QMainWindow):
-    def __init__(self, simulation, parent=None):
-        super(MainWindow, self).__init__(parent)
-        self.simulation = simulation
-        self.image_widget = ImageWidget(simulation.renderer.window)
-        self.setCentralWidget(self.image_widget)
-        self.init_ui()
-
-    def init_ui(self):
-        self.slider_decay = SliderWidget(Qt.Orientation.Horizontal, "Decay")
-        self.slider_diffusion = SliderWidget(Qt.Orientation.Horizontal, "Diffusion")
-
-        # Set initial slider values based on simulation config
-        self.slider_decay.slider.setValue(int(Config.DECAY * 100))
-        self.slider_diffusion.slider.setValue(int(Config.DIFFUSION * 100))
-
-        # Connect sliders to the simulation parameter update methods
-        self.slider_decay.slider.valueChanged.connect(self.simulation.update_decay)
-        self.slider_diffusion.slider.valueChanged.connect(self.simulation.update_diffusion)
-
-        # Add a restart button
-        self.restart_button = ButtonWidget("Restart Simulation", self.restart_simulation)
-
-        # Add an exit button
-        self.exit_button = ButtonWidget("Exit Application", self.quit_apps)
-
-        # Arrange widgets in the layout
-        layout = QVBoxLayout()
-        layout.addWidget(self.slider_decay)
-        layout.addWidget(self.slider_diffusion)
-        layout.addWidget(self.restart_button)
-        layout.addWidget(self.exit_button)
-        self.centralWidget().setLayout(layout)
-
-        # Timer to update the Pygame simulation
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_simulation)
-        self.timer.start(1000 // Config.FRAMERATE)  # Update as per simulation frame rate
-
-    def update_simulation(self):
-        # Code to update simulation and Pygame display
-        self.simulation.run_step()  
-        self.image_widget.update()  # Refresh the PyQt6 widget displaying the Pygame surface
-
-    def restart_simulation(self):
-        """ Restarts the simulation. """
-        self.simulation = PhysarumSimulation(Config.GRID_SIZE, Config.AGENT_COUNT, Config.FOOD_COUNT)  # Reinitialize the simulation
-
-
-    def quit_apps(self):
-        """ Quits the application. """
-        self.timer.stop()
-        pygame.quit()
-        app.quit()
-        sys.exit()
+import time
+
+
+def build_simulation(args, headless):
+    """ Import the simulation core, build a simulation and report how long both took. """
+    start = time.perf_counter()
+    from config import Config
+    from simulation import PhysarumSimulation
+    import numpy as np
+    imported = time.perf_counter()
+
+    if args.grid is not None:
+        Config.GRID_SIZE = tuple(args.grid)
+    if args.species is not None:
+        Config.SPECIES_COUNT = args.species
+    if args.seed is not None:
+        np.random.seed(args.seed)
+    agent_count = Config.AGENT_COUNT if args.agents is None else args.agents
+    food_count = Config.FOOD_COUNT if args.food is None else args.food
+    simulation = PhysarumSimulation(Config.GRID_SIZE, agent_count, food_count, headless=headless)
+    started = time.perf_counter()
+
+    timings = {'import': imported - start, 'startup': started - imported}
+    print(f"Imported the core in {timings['import']:.3f}s, started up in {timings['startup']:.3f}s", file=sys.stderr)
+    return simulation, timings
+
+
+def run_gui(args):
+    """ Run the interactive Qt application. """
+    simulation, _ = build_simulation(args, headless=False)
+    import gui
+    return gui.run_gui(simulation)
+
+
+def run(args):
+    """ Run a number of steps (or until interrupted), in the Pygame window or headless. """
+    simulation, _ = build_simulation(args, headless=args.headless)
+    if not args.headless:
+        simulation.run(args.steps)
+        return 0
+
+    server = None
+    if args.control_port is not None or args.control_socket is not None:
+        from control import ControlServer
+        server = ControlServer(simulation, port=args.control_port, socket_path=args.control_socket).start()
+        print(f'Control endpoint on {args.control_socket or f"http://{server.host}:{server.port}"}', file=sys.stderr)
+
+    start = time.perf_counter()
+    step = 0
+    try:
+        while args.steps is None or step < args.steps:
+            simulation.step()
+            step += 1
+            if args.progress and step % args.progress == 0:
+                print(f"Step {step}, {simulation.metrics['steps_per_second']:.1f} steps/s", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.stop()
+    elapsed = time.perf_counter() - start
+    print(f'Ran {step} steps in {elapsed:.3f}s ({step / max(elapsed, 1e-9):.1f} steps/s)', file=sys.stderr)
+    return 0
+
+
+def bench(args):
+    """ Measure cold start and headless step rate, failing if start up exceeds the budget. """
+    simulation, timings = build_simulation(args, headless=True)
+
+    # The first step includes compiling (or loading the cached) numba kernels
+    start = time.perf_counter()
+    simulation.step()
+    timings['first step'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        simulation.step()
+    elapsed = time.perf_counter() - start
+
+    cold_start = timings['import'] + timings['startup'] + timings['first step']
+    print(f"First step {timings['first step']:.3f}s, cold start {cold_start:.3f}s")
+    print(f'{args.steps} steps in {elapsed:.3f}s ({args.steps / max(elapsed, 1e-9):.1f} steps/s)')
+    if args.startup_budget is not None and cold_start > args.startup_budget:
+        print(f'Cold start {cold_start:.3f}s is over the budget of {args.startup_budget:.3f}s', file=sys.stderr)
+        return 1
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Physarum-Sandbox simulation')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--grid', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'), help='grid size in cells')
+    common.add_argument('--agents', type=int, help='number of agents')
+    common.add_argument('--food', type=int, help='number of initial food sources')
+    common.add_argument('--species', type=int, help='number of species')
+    common.add_argument('--seed', type=int, help='random seed')
+
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('gui', parents=[common], help='run the interactive application (default)')
+
+    run_parser = commands.add_parser('run', parents=[common], help='run the simulation for a number of steps')
+    run_parser.add_argument('--steps', type=int, help='number of steps to run, runs until interrupted if omitted')
+    run_parser.add_argument('--headless', action='store_true', help='run without a window')
+    run_parser.add_argument('--progress', type=int, default=0, metavar='N', help='report progress every N steps')
+    control = run_parser.add_mutually_exclusive_group()
+    control.add_argument('--control-port', type=int, metavar='PORT',
+                         help='serve the control endpoint on 127.0.0.1:PORT (headless only)')
+    control.add_argument('--control-socket', metavar='PATH', help='serve the control endpoint on a Unix socket (headless only)')
+
+    bench_parser = commands.add_parser('bench', parents=[common], help='measure start up time and step rate')
+    bench_parser.add_argument('--steps', type=int, default=100, help='number of timed steps')
+    bench_parser.add_argument('--startup-budget', type=float, metavar='SECONDS',
+                              help='exit with an error if the cold start takes longer')
+
+    # The GUI is the default subcommand, also when only common options are given
+    argv = list(argv)
+    if not argv or argv[0] not in commands.choices and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'gui')
+    args = parser.parse_args(argv)
+    if args.command == 'run' and not args.headless and (args.control_port is not None or args.control_socket is not None):
+        run_parser.error('--control-port and --control-socket require --headless')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    commands = {'gui': run_gui, 'run': run, 'bench': bench}
+    return commands[args.command](args)
 
-if __name__ == "__main__":
-    pygame.init()
-    simulation = PhysarumSimulation(Config.GRID_SIZE, Config.AGENT_COUNT, Config.FOOD_COUNT)
-
-    app = QApplication(sys.argv)
-    window = MainWindow(simulation)
-    window.show()
-    sys.exit(app.exec())
-
-
-    
 
-#  main.py :
-# from simulation import PhysarumSimulation
-# from config import Config
-
-
-# if __name__ == "__main__":
-
-#     simulation = PhysarumSimulation(Config.GRID_SIZE, Config.AGENT_COUNT, Config.FOOD_COUNT)
-#     simulation.run()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,31 +3,75 @@
 from patterns import Renderer
 from states import SearchState, FeedState
 from config import Config
-from utils import color_from_value
+from utils import color_from_value, build_channel_luts, composite_channels
+from viewport import Viewport, MipPyramid
 import pygame
 import numpy as np
 import numba
 
 class PygameRenderer(Renderer):
     """ Renderer class for the Pygame visualization."""
-    def __init__(self, window, cell_size, grid_size):
+    def __init__(self, window, cell_size, grid_size, channels=1, viewport=None, colors=None):
         self.window = window
         self.cell_size = cell_size
         self.grid_size = grid_size
+        self.channels = channels
+        # Pan/zoom window over the grid, only the visible part of the grid is drawn
+        self.viewport = viewport or Viewport(window.get_size(), grid_size, cell_size)
+
+        # One lookup table per trail channel, composited additively
+        self.luts = build_channel_luts(channels, Config.SPECIES_COLORS if colors is None else colors)
+        self._pixels = np.zeros((0, 0, 3), dtype=np.uint8)
+        self._source = None
+        self._pyramid = None
+        self._pyramids = {}  # Grid shape -> pyramid, reused when switching between grids of one shape
+        self._frame = 0
 
     def render(self, grid):
         self.window.fill(Config.BACKGROUND_COLOR)  # Fill the background
 
-        # Draw the grid
-        for x in range(self.grid_size[0]):
-            for y in range(self.grid_size[1]):
-                rect = pygame.Rect(x * self.cell_size, y * self.cell_size, 
-                                   self.cell_size, self.cell_size)
-                color = self._get_color_from_value(grid[x, y], Config.MAX_TRAIL_VALUE)
-                pygame.draw.rect(self.window, color, rect)
+        if grid is not self._source:
+            self._source = grid
+            grid = grid if grid.ndim == 3 else grid[np.newaxis]
+            self._pyramid = self._pyramids.get(grid.shape)
+            if self._pyramid is None:
+                self._pyramid = self._pyramids[grid.shape] = MipPyramid(grid)
+            else:
+                self._pyramid.set_grid(grid)
+        elif self._frame % Config.LOD_REFRESH_INTERVAL == 0:
+            self._pyramid.mark_stale()
+        self._frame += 1
+
+        # Pick the mipmap level matching the zoom and cut out the visible cells
+        level = self.viewport.level(self._pyramid.levels)
+        scale = 2 ** level
+        x0, y0, x1, y1 = self.viewport.visible_rect()
+        if level > 0:
+            # Refresh the visible blocks of the coarse levels, a number of cells bounded by the window size
+            width, height = self.window.get_size()
+            budget = max(1, Config.LOD_REFRESH_BUDGET * width * height // self._pyramid.block_size ** 2)
+            self._pyramid.refresh((x0, y0, x1, y1), budget)
+        x0, y0 = x0 // scale, y0 // scale
+        x1, y1 = -(-x1 // scale), -(-y1 // scale)
+        source = self._pyramid.level(level, Config.LOD_REDUCTION)[:, x0:x1, y0:y1]
+
+        # Colormap only the visible region, then scale it onto the screen
+        if self._pixels.shape[:2] != source.shape[1:]:
+            self._pixels = np.zeros((source.shape[1], source.shape[2], 3), dtype=np.uint8)
+        composite_channels(source, self.luts, Config.MAX_TRAIL_VALUE, self._pixels)
+        screen_x0, screen_y0 = self.viewport.grid_to_screen(x0 * scale, y0 * scale)
+        screen_x1, screen_y1 = self.viewport.grid_to_screen(x1 * scale, y1 * scale)
+        size = (int(round(screen_x1 - screen_x0)), int(round(screen_y1 - screen_y0)))
+        surface = pygame.transform.scale(pygame.surfarray.make_surface(self._pixels), size)
+        self.window.blit(surface, (int(round(screen_x0)), int(round(screen_y0))))
 
         pygame.display.update()  # Update the display
 
+    def invalidate(self):
+        """ Rebuild the mipmap levels on the next frame, after the grid was changed as a whole. """
+        if self._pyramid is not None:
+            self._pyramid.invalidate()
+
     @staticmethod
     def _get_color_from_value(value, max_trail_value):
         """
@@ -41,22 +85,42 @@ class PygameRenderer(Renderer):
         Update the agent's position on the screen. This could involve drawing a
         special icon or using a different color to denote the agent's position.
         """
-        pixel_x = x * self.cell_size
-        pixel_y = y * self.cell_size
         if isinstance(agent_state, SearchState):
             agent_color = Config.AGENT_SEARCH_COLOR
         elif isinstance(agent_state, FeedState):
             agent_color = Config.AGENT_FEED_COLOR
         else:
             agent_color = Config.AGENT_DEFAULT_COLOR
-        pygame.draw.circle(self.window, agent_color, (pixel_x, pixel_y), self.cell_size // 2)
+        # Called for every move, so a scalar check instead of the array path of draw_points
+        screen_x, screen_y = self.viewport.grid_to_screen(x, y)
+        width, height = self.viewport.screen_size
+        if 0 <= screen_x < width and 0 <= screen_y < height:
+            radius = max(int(self.viewport.zoom) // 2, 1)
+            pygame.draw.circle(self.window, agent_color, (int(screen_x), int(screen_y)), radius)
 
     def draw_agent(self, agent):
         # Assuming agent color is defined in the agent class or through its state
         agent_color = self._get_agent_color(agent)
-        pixel_x = int(agent.x * self.cell_size)
-        pixel_y = int(agent.y * self.cell_size)
-        pygame.draw.circle(self.window, agent_color, (pixel_x, pixel_y), self.cell_size // 2)
+        self.draw_points(np.array([agent.x]), np.array([agent.y]), agent_color)
+
+    def draw_agents(self, agents):
+        """ Draw all agents, grouped by color so off-screen agents are culled in bulk. """
+        by_color = {}
+        for agent in agents:
+            xs, ys = by_color.setdefault(self._get_agent_color(agent), ([], []))
+            xs.append(agent.x)
+            ys.append(agent.y)
+        for agent_color, (xs, ys) in by_color.items():
+            self.draw_points(np.array(xs), np.array(ys), agent_color)
+
+    def draw_points(self, xs, ys, color):
+        """ Draw markers at grid coordinates, skipping the ones outside the viewport. """
+        x0, y0, x1, y1 = self.viewport.visible_rect()
+        visible = (xs >= x0) & (xs < x1) & (ys >= y0) & (ys < y1)
+        screen_xs, screen_ys = self.viewport.grid_to_screen(xs[visible], ys[visible])
+        radius = max(int(self.viewport.zoom) // 2, 1)
+        for pixel_x, pixel_y in zip(screen_xs.astype(int), screen_ys.astype(int)):
+            pygame.draw.circle(self.window, color, (pixel_x, pixel_y), radius)
 
     def _get_agent_color(self, agent):
         # Return color based on agent's state
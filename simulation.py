@@ -1,77 +1,259 @@
 # simulation.py :
 from patterns import Observer
-from grid import PhysarumGridBuilder
-from renderer import PygameRenderer
-from agents import PhysarumAgentFactory
+from grid import PhysarumGridBuilder, MappedGrid
+from history import GridHistory
+from diffusion import DIFFUSION_ENGINES
+from agents import PhysarumAgentFactory, default_species_weights, random_distances
 from states import SearchState, FeedState
 from config import Config
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import time
 import numba
-import pygame
 import numpy as np
 
 
 class PhysarumSimulation(Observer):
     """ Simulation class for the Physarum simulation."""
-    def __init__(self, grid_size, agent_count, food_count):
+    def __init__(self, grid_size, agent_count, food_count, headless=False):
         self.grid_size = grid_size
         self.agent_count = agent_count
         self.food_count = food_count
+        self.species_count = Config.SPECIES_COUNT
+        # Several species get an extra food channel so food is never weighted as a rival trail
+        self.channel_count = self.species_count + 1 if self.species_count > 1 else 1
+        self.food_channel = self.channel_count - 1
+        self.species_weights = self._initialize_species_weights()
+        self.agent_factory = PhysarumAgentFactory(self.species_weights)
         self.grid_builder = PhysarumGridBuilder()
 
         self.grid = self._initialize_grid()
         self._place_initial_food()
-        self.agents = self._initialize_agents()
-        self._attach_agents()
+        self.agents = []
+        self._place_agents()
+        self._attach_agents(self.agents)
+
+        # Rewindable history of the grid and agents, only recorded on request since it slows down every step
+        self.step_count = 0
+        self.history = None
+        self._history_grid = None
+        if Config.HISTORY_ENABLED:
+            self.enable_history()
+
+        # Work queued from other threads (parameter changes, checkpoints) and run between steps
+        self._between_steps = deque()
+        self._save_executor = None
+        self.metrics = {'step': self.step_count, 'steps_per_second': 0.0, 'agents': len(self.agents)}
+        self._last_step_time = None
+        self._diffusion_engines = {}  # Diffusion mode -> engine, created when first used
+
+        # Headless simulations only support step() and never import Pygame
+        self.window = None
+        self.viewport = None
+        self.renderer = None
+        if not headless:
+            self._initialize_display()
+
+    def _initialize_display(self):
+        """ Initialize the Pygame window and renderer, grids larger than WINDOW_SIZE are shown through a viewport. """
+        import pygame
+        from renderer import PygameRenderer
+        from viewport import Viewport
 
-        # Initialize the Pygame window and renderer
         pygame.init()
-        window_size = (self.grid_size[0] * Config.CELL_SIZE, self.grid_size[1] * Config.CELL_SIZE)
+        window_size = (min(self.grid_size[0] * Config.CELL_SIZE, Config.WINDOW_SIZE[0]),
+                       min(self.grid_size[1] * Config.CELL_SIZE, Config.WINDOW_SIZE[1]))
         self.window = pygame.display.set_mode(window_size)
-        self.renderer = PygameRenderer(self.window, Config.CELL_SIZE, self.grid_size)
+        self.viewport = Viewport(window_size, self.grid_size, Config.CELL_SIZE)
+        colors = [Config.SPECIES_COLORS[c % len(Config.SPECIES_COLORS)] for c in range(self.species_count)]
+        if self.channel_count > self.species_count:
+            colors.append(Config.FOOD_COLOR)
+        self.renderer = PygameRenderer(self.window, Config.CELL_SIZE, self.grid_size, self.channel_count,
+                                       self.viewport, colors)
 
 
+    def _initialize_species_weights(self, params=None):
+        """
+        Build the (species x channels) sensing weights from the configuration, with the
+        values in `params` taking precedence. A (species x species) matrix is extended
+        with a weight of 1 for the food channel. Raises ValueError for a bad matrix.
+        """
+        params = params or {}
+        species_weights = params.get('SPECIES_WEIGHTS', Config.SPECIES_WEIGHTS)
+        if species_weights is None:
+            weights = default_species_weights(self.species_count, params.get('SPECIES_REPULSION', Config.SPECIES_REPULSION))
+        else:
+            weights = np.asarray(species_weights, dtype=np.float64)
+        if weights.shape == (self.species_count, self.species_count) and self.channel_count > self.species_count:
+            weights = np.hstack([weights, np.ones((self.species_count, 1))])
+        if weights.shape != (self.species_count, self.channel_count):
+            shapes = {(self.species_count, self.species_count), (self.species_count, self.channel_count)}
+            raise ValueError(f"SPECIES_WEIGHTS must have shape {' or '.join(map(str, sorted(shapes)))}, got {weights.shape}")
+        return weights
+
     def _initialize_grid(self):
-        # Use unpacking to pass the width and height separately
-        self.grid_builder.set_dimensions(*self.grid_size)
+        # Use unpacking to pass the width and height separately, one trail channel per species
+        self.grid_builder.set_dimensions(*self.grid_size).set_channels(self.channel_count)
+        if Config.GRID_BACKING_FILE is not None:
+            # Keep the trail field on disk for grids that do not fit in memory
+            self.grid_builder.set_backing_file(Config.GRID_BACKING_FILE, Config.TILE_SIZE, Config.TILE_CACHE_SIZE)
         return self.grid_builder.build()
 
-    def _initialize_agents(self):
-        """ Initialize agents with random positions and directions. """
-        agents = []
-        for _ in range(self.agent_count):
-            x = np.random.randint(self.grid_size[0])
-            y = np.random.randint(self.grid_size[1])
-            angle = np.random.rand() * 2 * np.pi
+    def _place_agents(self):
+        """ Give agents random positions and directions, reusing the existing agent objects. """
+        # Everything random is drawn in bulk, the same way for new and reused agents
+        xs = np.random.randint(self.grid_size[0], size=self.agent_count).tolist()
+        ys = np.random.randint(self.grid_size[1], size=self.agent_count).tolist()
+        angles = (np.random.rand(self.agent_count) * 2 * np.pi).tolist()
+        sensor_distances, move_distances = (values.tolist() for values in random_distances(self.agent_count))
+        weights = list(self.species_weights)
+        for i in range(self.agent_count):
+            # Spread agents evenly over the species
+            species = i % self.species_count
+            if i < len(self.agents):
+                self.agents[i].reset(xs[i], ys[i], angles[i], species, weights[species],
+                                     sensor_distances[i], move_distances[i])
+                continue
             # Create a new agent using the factory and pass in the initial parameters
-            agent = PhysarumAgentFactory().create_agent(x, y, angle)
-            agents.append(agent)
+            agent = self.agent_factory.create_agent(xs[i], ys[i], angles[i], species,
+                                                    sensor_distances[i], move_distances[i])
+            self.agents.append(agent)
             # Register the simulation as an observer to the agent's state changes
             agent.register_observer(self)
-        return agents
+        del self.agents[self.agent_count:]
+
+    def enable_history(self):
+        """ Start recording a rewindable history of the grid and agents from the current step. """
+        if self.history is None:
+            self.history = GridHistory(Config.HISTORY_TILE_SIZE, Config.HISTORY_KEYFRAME_INTERVAL,
+                                       Config.HISTORY_TOLERANCE, Config.HISTORY_BUDGET_MB * 2**20)
+            self.history.record(self.step_count, self.grid, self.agent_arrays())
+
+    def reset(self, seed=None, params=None):
+        """
+        Restart the simulation in place. The grid is zeroed, food and agents are placed
+        again and the history is cleared, while the grid and agent objects, the window,
+        the renderer and the compiled kernels are all reused. `params` maps Config names
+        to new values, except the ones that size the reused buffers.
+        """
+        if params:
+            self._apply_params(self._check_params(params))
+        if seed is not None:
+            np.random.seed(seed)
+
+        self.grid.fill(0)
+        self._place_initial_food()
+        agent_count = len(self.agents)
+        self._place_agents()
+        self._attach_agents(self.agents[agent_count:])
+
+        self.step_count = 0
+        self._last_step_time = None
+        if self.history is not None:
+            self.history.clear()
+            self.history.record(self.step_count, self.grid, self.agent_arrays())
+        if self.renderer is not None:
+            self.renderer.invalidate()
+
+    def _check_params(self, params, running=False):
+        """
+        Return the parameters converted to the types of the current Config values. Raise
+        ValueError for unknown or invalid parameters and ones that size the simulation buffers,
+        and when `running` also for the counts that are only used when placing agents and food.
+        """
+        fixed = {'GRID_SIZE': tuple(self.grid_size), 'SPECIES_COUNT': self.species_count,
+                 'GRID_BACKING_FILE': Config.GRID_BACKING_FILE, 'TILE_SIZE': Config.TILE_SIZE,
+                 'CELL_SIZE': Config.CELL_SIZE, 'WINDOW_SIZE': Config.WINDOW_SIZE}
+        placed = {'AGENT_COUNT': self.agent_count, 'FOOD_COUNT': self.food_count}
+        checked = {}
+        for name, value in params.items():
+            if not hasattr(Config, name):
+                raise ValueError(f'Unknown parameter {name}')
+            value = checked[name] = self._convert_param(name, value, getattr(Config, name))
+            if name in fixed and value != fixed[name]:
+                raise ValueError(f'{name} cannot be changed on a running simulation, create a new one instead')
+            if running and name in placed and value != placed[name]:
+                raise ValueError(f'{name} only takes effect when the simulation is reset, pass it to reset instead')
+        if checked.get('DIFFUSION_MODE', Config.DIFFUSION_MODE) not in DIFFUSION_ENGINES:
+            raise ValueError(f"Unknown diffusion mode {checked['DIFFUSION_MODE']!r}, expected one of {sorted(DIFFUSION_ENGINES)}")
+        if checked.get('DIFFUSION_PASSES', 1) < 1:
+            raise ValueError('DIFFUSION_PASSES must be at least 1')
+        for name in ('AGENT_COUNT', 'FOOD_COUNT'):
+            if checked.get(name, 0) < 0:
+                raise ValueError(f'{name} cannot be negative')
+        if 'SPECIES_WEIGHTS' in checked or 'SPECIES_REPULSION' in checked:
+            # Build the weights now so that a bad matrix never reaches Config
+            self._initialize_species_weights(checked)
+        return checked
+
+    @staticmethod
+    def _convert_param(name, value, current):
+        """ Convert a new value to the type of the current one, raise ValueError if it does not fit. """
+        if current is None:
+            return value  # Optional values are checked where they are used
+        if isinstance(current, bool):
+            if not isinstance(value, bool):
+                raise ValueError(f'{name} must be true or false, got {value!r}')
+            return value
+        if isinstance(current, int):
+            # Integer values such as counts and passes, floats are only accepted when whole
+            if isinstance(value, float) and value.is_integer():
+                return int(value)
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f'{name} must be an integer, got {value!r}')
+            return value
+        if isinstance(current, float):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'{name} must be a number, got {value!r}')
+            return float(value)
+        if isinstance(current, str):
+            if not isinstance(value, str):
+                raise ValueError(f'{name} must be a string, got {value!r}')
+            return value
+        if isinstance(current, (tuple, list)):
+            # Sizes and colors, lists arrive from JSON where tuples are expected
+            if not isinstance(value, (tuple, list)) or (isinstance(current, tuple) and len(value) != len(current)):
+                raise ValueError(f'{name} must be a sequence like {current!r}, got {value!r}')
+            if current and not isinstance(current[0], (tuple, list)):
+                value = [PhysarumSimulation._convert_param(name, item, current[0]) for item in value]
+            return type(current)(tuple(item) if isinstance(item, list) else item for item in value)
+        return value
+
+    def _apply_params(self, params):
+        """ Update Config with new parameter values, between steps or before a reset, and return them. """
+        for name, value in params.items():
+            setattr(Config, name, value)
+
+        self.agent_count = params.get('AGENT_COUNT', self.agent_count)
+        self.food_count = params.get('FOOD_COUNT', self.food_count)
+        # Agents hold rows of the weight matrix, so it is updated in place
+        self.species_weights[:] = self._initialize_species_weights()
+        return params
 
     @staticmethod
-    @numba.jit(nopython=True)
-    def _place_food(grid, x, y, radius, food_value):
-        """ Place food on the grid at the specified location and radius. """
+    @numba.jit(nopython=True, cache=True)
+    def _place_food(grid, x, y, radius, food_value, channel):
+        """ Place food in the food channel of the grid at the specified location and radius. """
         min_x = max(0, x - radius)
-        max_x = min(grid.shape[0], x + radius + 1)
+        max_x = min(grid.shape[1], x + radius + 1)
         min_y = max(0, y - radius)
-        max_y = min(grid.shape[1], y + radius + 1)
+        max_y = min(grid.shape[2], y + radius + 1)
 
         for i in range(min_x, max_x):
             for j in range(min_y, max_y):
                 if (i - x) ** 2 + (j - y) ** 2 <= radius ** 2:
-                    grid[i, j] = food_value
+                    grid[channel, i, j] = food_value
 
     def _place_initial_food(self):
         """ Randomly place initial food particles on the grid. """
         for _ in range(self.food_count):
             x = np.random.randint(self.grid_size[0])
             y = np.random.randint(self.grid_size[1])
-            self._place_food(self.grid, x, y, Config.INIT_FOOD_RADIUS, Config.INIT_FOOD_VALUE)
+            self._apply_stamp(self._place_food, x, y, Config.INIT_FOOD_RADIUS, Config.INIT_FOOD_VALUE, self.food_channel)
 
-    def _attach_agents(self):
-        for agent in self.agents:
+    def _attach_agents(self, agents):
+        for agent in agents:
             agent.register_observer(self)
 
     def update(self, data):
@@ -91,7 +273,7 @@ class PhysarumSimulation(Observer):
 
             # Update the grid based on the agent's actions
             if isinstance(agent_state, SearchState):
-                self._handle_search_state(x, y)
+                self._handle_search_state(x, y, agent.species)
             elif isinstance(agent_state, FeedState):
                 self._handle_feed_state(x, y)
 
@@ -99,26 +281,111 @@ class PhysarumSimulation(Observer):
             self._update_visualization(x, y, agent_state)
 
     def update_decay(self, value):
-        Config.DECAY = value / 100.0
-        print("Updated Decay: ", Config.DECAY)
+        self.set_params({'DECAY': value / 100.0})
 
     def update_diffusion(self, value):
-        Config.DIFFUSION = value / 100.0
-        print("Updated Diffusion: ", Config.DIFFUSION)
+        self.set_params({'DIFFUSION': value / 100.0})
+
+    def set_params(self, params):
+        """
+        Queue new Config values to be applied together before the next step. Safe to call
+        from any thread, returns a Future that completes with the converted values once
+        they are in effect.
+        """
+        return self.call_between_steps(self._apply_params, self._check_params(params, running=True))
+
+    def call_between_steps(self, function, *args):
+        """ Queue a call to run on the simulation thread before the next step, returns its Future. """
+        future = Future()
+        self._between_steps.append((future, function, args))
+        return future
+
+    def _run_between_steps(self):
+        while self._between_steps:
+            future, function, args = self._between_steps.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue  # Cancelled while queued, such as by a control server that stopped
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+
+    def save_checkpoint(self, path):
+        """
+        Save the grid, the agents and the step count to a compressed .npz file. Call between
+        steps: the state is copied there and compressed on a background thread, so this
+        returns a Future that completes with the path once the file is written.
+        """
+        path = path if path.endswith('.npz') else path + '.npz'  # As numpy names the file
+        agents = self.agent_arrays()
+        agents['sensor_distance'] = np.array([agent.sensor_distance for agent in self.agents])
+        agents['move_distance'] = np.array([agent.move_distance for agent in self.agents])
+        arrays = {f'agent_{name}': values for name, values in agents.items()}
+        grid = self._copy_grid(f'{path}.grid.npy')
+        return self._saver().submit(self._write_checkpoint, path, grid, self.step_count, arrays)
+
+    @staticmethod
+    def _write_checkpoint(path, grid, step, arrays):
+        try:
+            np.savez_compressed(path, grid=grid, step=step, **arrays)  # Written in chunks, a mapped copy is never loaded whole
+        finally:
+            if isinstance(grid, np.memmap):
+                filename = grid.filename
+                del grid
+                os.remove(filename)
+        return path
+
+    def save_snapshot(self, path):
+        """
+        Save the trail grid alone to a .npy file. Call between steps, returns a Future that
+        completes with the path once the file is written, on a background thread for
+        in-memory grids and straight from the tiles for memory-mapped ones.
+        """
+        path = path if path.endswith('.npy') else path + '.npy'
+        if isinstance(self.grid, MappedGrid):
+            self._copy_grid(path)
+            future = Future()
+            future.set_result(path)
+            return future
+        return self._saver().submit(self._write_snapshot, path, self.grid.copy())
 
-    def _handle_search_state(self, x, y):
+    @staticmethod
+    def _write_snapshot(path, grid):
+        np.save(path, grid)
+        return path
+
+    def _copy_grid(self, path):
+        """
+        Copy of the grid taken between steps. A memory-mapped grid may not fit in memory,
+        so it is copied tile by tile into a .npy file at `path` instead.
+        """
+        if not isinstance(self.grid, MappedGrid):
+            return self.grid.copy()
+        copy = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=self.grid.shape)
+        for x0, y0, tile in self.grid.iter_tiles():
+            copy[:, x0:x0 + tile.shape[1], y0:y0 + tile.shape[2]] = tile
+        copy.flush()
+        return copy
+
+    def _saver(self):
+        """ Single background thread that writes checkpoints and snapshots in order. """
+        if self._save_executor is None:
+            self._save_executor = ThreadPoolExecutor(max_workers=1)
+        return self._save_executor
+
+    def _handle_search_state(self, x, y, species):
         """
         Handle updates to the grid when the agent is in a search state.
         """
-        # Increase the value at the current grid position to leave a trail
-        self.grid[x, y] += Config.TRAIL_VALUE
+        # Increase the value at the current grid position to leave a trail in the species channel
+        self.grid[species, x, y] += Config.TRAIL_VALUE
 
     def _handle_feed_state(self, x, y):
         """
         Handle updates to the grid when the agent is in a feed state.
         """
         # Decrease the food amount at the agent's position
-        self.grid[x, y] = max(0, self.grid[x, y] - Config.FOOD_CONSUMED)
+        self.grid[self.food_channel, x, y] = max(0, self.grid[self.food_channel, x, y] - Config.FOOD_CONSUMED)
 
     def _update_visualization(self, x, y, agent_state):
         """
@@ -130,59 +397,127 @@ class PhysarumSimulation(Observer):
             # If you're using Pygame, you might need to call `pygame.display.update()` or similar
     
     @staticmethod
-    @numba.jit(nopython=True)
-    def _apply_decay_and_diffusion(grid, decay, diffusion, cell_size):
-        """ Apply decay and diffusion to the grid. """
-        new_grid = np.empty_like(grid)
-        for i in range(grid.shape[0]):
-            for j in range(grid.shape[1]):
-                # Apply decay
-                new_grid[i, j] = grid[i, j] * (1 - decay)
-
-                # Apply diffusion
-                for di in [-1, 0, 1]:
-                    for dj in [-1, 0, 1]:
-                        if di == 0 and dj == 0:
-                            continue
-                        ii = (i + di) % grid.shape[0]
-                        jj = (j + dj) % grid.shape[1]
-                        new_grid[i, j] += grid[ii, jj] * diffusion / cell_size
-
-        grid[:, :] = new_grid[:, :]
-
-    @staticmethod
-    @numba.jit(nopython=True)
+    @numba.jit(nopython=True, cache=True)
     def _clear_chemotrails(grid, x, y, radius):
-        """ Clear chemotrails on the grid at the specified location and radius. """
+        """ Clear chemotrails in every channel of the grid at the specified location and radius. """
         min_x = max(0, x - radius)
-        max_x = min(grid.shape[0], x + radius + 1)
+        max_x = min(grid.shape[1], x + radius + 1)
         min_y = max(0, y - radius)
-        max_y = min(grid.shape[1], y + radius + 1)
+        max_y = min(grid.shape[2], y + radius + 1)
 
-        for i in range(min_x, max_x):
-            for j in range(min_y, max_y):
-                if (i - x) ** 2 + (j - y) ** 2 <= radius ** 2:
-                    grid[i, j] = 0
+        for c in range(grid.shape[0]):
+            for i in range(min_x, max_x):
+                for j in range(min_y, max_y):
+                    if (i - x) ** 2 + (j - y) ** 2 <= radius ** 2:
+                        grid[c, i, j] = 0
+
+    def _apply_stamp(self, kernel, x, y, radius, *args):
+        """
+        Run a circular stamp kernel such as `_place_food` on just the region it covers,
+        which is a view for in-memory grids and a copy that is written back for mapped ones.
+        """
+        min_x, max_x = max(0, x - radius), min(self.grid_size[0], x + radius + 1)
+        min_y, max_y = max(0, y - radius), min(self.grid_size[1], y + radius + 1)
+        region = self.grid[:, min_x:max_x, min_y:max_y]
+        kernel(region, x - min_x, y - min_y, radius, *args)
+        if isinstance(self.grid, MappedGrid):
+            self.grid[:, min_x:max_x, min_y:max_y] = region
+
+    def step(self):
+        """ Advance the simulation by one step: move every agent, then decay and diffuse the trails. """
+        self._run_between_steps()
+
+        # Visit agents tile by tile for locality, in the same order whatever the grid, so that
+        # in-memory and mapped runs stay identical. They move little, so the list is nearly sorted
+        tile_size = Config.TILE_SIZE
+        self.agents.sort(key=lambda agent: (agent.x // tile_size, agent.y // tile_size))
+        if isinstance(self.grid, MappedGrid):
+            # Visit agents tile by tile while the tiles they move into are prefetched in the background
+            agents = self.grid.stream_agents(self.agents)
+        else:
+            agents = self.agents
+        for agent in agents:
+            agent.sense_and_move(self.grid)
+
+        self._diffuse()
+
+        self.step_count += 1
+        if self.history is not None:
+            self.history.record(self.step_count, self.grid, self.agent_arrays())
+        self._update_metrics()
+
+    def _diffuse(self):
+        """ Decay and diffuse the trails by DIFFUSION_PASSES stencil passes, with the DIFFUSION_MODE engine. """
+        if isinstance(self.grid, MappedGrid):
+            # Mapped grids are streamed tile by tile, which only the stencil supports
+            for _ in range(Config.DIFFUSION_PASSES):
+                self.grid.decay_and_diffuse(Config.DECAY, Config.DIFFUSION, Config.CELL_SIZE)
+            return
+
+        engine = self._diffusion_engines.get(Config.DIFFUSION_MODE)
+        if engine is None:
+            if Config.DIFFUSION_MODE not in DIFFUSION_ENGINES:
+                raise ValueError(f'Unknown diffusion mode {Config.DIFFUSION_MODE!r}, expected one of {sorted(DIFFUSION_ENGINES)}')
+            engine = self._diffusion_engines[Config.DIFFUSION_MODE] = DIFFUSION_ENGINES[Config.DIFFUSION_MODE]()
+        engine.apply(self.grid, Config.DECAY, Config.DIFFUSION, Config.CELL_SIZE, Config.DIFFUSION_PASSES)
+
+    def _update_metrics(self):
+        # Publish a new dict each step so that readers on other threads always see a consistent one
+        now = time.perf_counter()
+        rate = self.metrics['steps_per_second']
+        if self._last_step_time is not None and now > self._last_step_time:
+            instant = 1.0 / (now - self._last_step_time)
+            rate = instant if rate == 0.0 else 0.9 * rate + 0.1 * instant
+        self._last_step_time = now
+        self.metrics = {'step': self.step_count, 'steps_per_second': rate, 'agents': len(self.agents)}
+
+    def agent_arrays(self):
+        """ Positions, angles and species of all agents as arrays. """
+        return {'x': np.array([agent.x for agent in self.agents], dtype=np.int64),
+                'y': np.array([agent.y for agent in self.agents], dtype=np.int64),
+                'angle': np.array([agent.angle for agent in self.agents], dtype=np.float64),
+                'species': np.array([agent.species for agent in self.agents], dtype=np.int64)}
+
+    def show_history(self, step):
+        """
+        Render the recorded state of `step` instead of the live one.
+        Raises KeyError if the step is no longer in the history.
+        """
+        import pygame
+
+        if self._history_grid is None:
+            self._history_grid = np.empty(self.grid.shape)
+        _, agents = self.history.reconstruct(step, self._history_grid)
+        self.renderer.invalidate()  # The history grid is reused for every step shown
+        self.renderer.render(self._history_grid)
+        self.renderer.draw_points(agents['x'], agents['y'], Config.AGENT_DEFAULT_COLOR)
+        pygame.display.update()
 
     def render(self, renderer):
         renderer.render(self.grid)
 
-    def run_step(self):
-        # Handle Pygame events
+    def _handle_input(self):
+        """ Process Pygame events and mouse buttons, returns False once the window is closed. """
+        import pygame
+
+        running = True
         mouse_x, mouse_y = pygame.mouse.get_pos()
-        grid_x, grid_y = mouse_x // Config.CELL_SIZE, mouse_y // Config.CELL_SIZE
+        grid_x, grid_y = self.viewport.screen_to_grid(mouse_x, mouse_y)
         # Process Pygame events to handle user input or window closure
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
 
+            elif event.type == pygame.MOUSEWHEEL:  # Zoom around the mouse position
+                self.viewport.zoom_at(Config.ZOOM_STEP ** event.y, mouse_x, mouse_y)
+
             elif event.type == pygame.KEYDOWN:
 
                 if event.key == pygame.K_a:  # 'A' key to add a new agent
 
-                    # Create a new agent at the mouse position with a random angle
+                    # Create a new agent at the mouse position with a random angle and species
                     new_angle = np.random.rand() * 2 * np.pi
-                    new_agent = PhysarumAgentFactory().create_agent(grid_x, grid_y, new_angle)
+                    new_agent = self.agent_factory.create_agent(grid_x, grid_y, new_angle, np.random.randint(self.species_count))
                     
                     # Add the new agent to the simulation
                     self.agents.append(new_agent)
@@ -196,34 +531,46 @@ class PhysarumSimulation(Observer):
                     # Create a list to hold agents that are not deleted
                     surviving_agents = []
                     for agent in self.agents:
-                        agent_x = agent.x * Config.CELL_SIZE
-                        agent_y = agent.y * Config.CELL_SIZE
-                        distance = np.sqrt((agent_x - mouse_x)**2 + (agent_y - mouse_y)**2)
+                        distance = np.sqrt((agent.x - grid_x)**2 + (agent.y - grid_y)**2)
 
-                        if distance > delete_radius * Config.CELL_SIZE:
+                        if distance > delete_radius:
                             surviving_agents.append(agent)
 
                     # Update the agents list to only include surviving agents
                     self.agents = surviving_agents
 
-            # Implement food placement and chemotrail clearing
+                # Arrow keys pan the view, 'Home' zooms out to the whole grid
+                if event.key == pygame.K_LEFT:
+                    self.viewport.pan(-Config.PAN_STEP, 0)
+                elif event.key == pygame.K_RIGHT:
+                    self.viewport.pan(Config.PAN_STEP, 0)
+                elif event.key == pygame.K_UP:
+                    self.viewport.pan(0, -Config.PAN_STEP)
+                elif event.key == pygame.K_DOWN:
+                    self.viewport.pan(0, Config.PAN_STEP)
+                elif event.key == pygame.K_HOME:
+                    self.viewport.reset()
+
+        # Implement food placement and chemotrail clearing
         if pygame.mouse.get_pressed()[0]:
-            self._place_food(self.grid, grid_x, grid_y, Config.FOOD_RADIUS, Config.POSTFOOD_VALUE)
+            self._apply_stamp(self._place_food, grid_x, grid_y, Config.FOOD_RADIUS, Config.POSTFOOD_VALUE, self.food_channel)
         elif pygame.mouse.get_pressed()[2]:
             # self.clear_chemotrails(grid_x, grid_y, Config.CLEAR_RADIUS)
-            self._clear_chemotrails(self.grid, grid_x, grid_y, Config.CLEAR_RADIUS)
+            self._apply_stamp(self._clear_chemotrails, grid_x, grid_y, Config.CLEAR_RADIUS)
+        return running
 
-        # Update agents and grid for a single step
-        for agent in self.agents:
-            agent.sense_and_move(self.grid)
+    def run_step(self):
+        import pygame
 
-        # Apply decay and diffusion to the grid
-        self._apply_decay_and_diffusion(self.grid, Config.DECAY, Config.DIFFUSION, Config.CELL_SIZE)
+        # Handle Pygame events
+        self._handle_input()
+
+        # Update agents, then apply decay and diffusion to the grid for a single step
+        self.step()
 
-        # Render the grid and agents
+        # Render the grid and the agents inside the viewport
         self.renderer.render(self.grid)
-        for agent in self.agents:
-            self.renderer.draw_agent(agent)
+        self.renderer.draw_agents(self.agents)
 
         # Update the Pygame display
         # pygame.display.flip()  # Or pygame.display.update(), depending on your version of Pygame
@@ -232,69 +579,28 @@ class PhysarumSimulation(Observer):
         # If Config.SIMULATION_DELAY > 0:
         #     pygame.time.delay(Config.SIMULATION_DELAY)
 
-    def run(self):
+    def run(self, steps=None):
+        """ Run the interactive loop until the window is closed or `steps` steps have been made. """
+        import pygame
+
         self._place_initial_food()
 
         clock = pygame.time.Clock()
 
         running = True
-        while running:
-            # Handle Pygame events
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            grid_x, grid_y = mouse_x // Config.CELL_SIZE, mouse_y // Config.CELL_SIZE
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-
-                elif event.type == pygame.KEYDOWN:
-
-                    if event.key == pygame.K_a:  # 'A' key to add a new agent
-
-                        # Create a new agent at the mouse position with a random angle
-                        new_angle = np.random.rand() * 2 * np.pi
-                        new_agent = PhysarumAgentFactory().create_agent(grid_x, grid_y, new_angle)
-                        
-                        # Add the new agent to the simulation
-                        self.agents.append(new_agent)
-                        new_agent.register_observer(self)
+        while running and (steps is None or steps > 0):
+            if steps is not None:
+                steps -= 1
 
-                    if event.key == pygame.K_d:  # Delete agent with 'D' key
-
-                        # Define the radius within which agents will be deleted
-                        delete_radius = 5  # Adjust as necessary
-
-                        # Create a list to hold agents that are not deleted
-                        surviving_agents = []
-                        for agent in self.agents:
-                            agent_x = agent.x * Config.CELL_SIZE
-                            agent_y = agent.y * Config.CELL_SIZE
-                            distance = np.sqrt((agent_x - mouse_x)**2 + (agent_y - mouse_y)**2)
-
-                            if distance > delete_radius * Config.CELL_SIZE:
-                                surviving_agents.append(agent)
-
-                        # Update the agents list to only include surviving agents
-                        self.agents = surviving_agents
-
-             # Implement food placement and chemotrail clearing
-            if pygame.mouse.get_pressed()[0]:
-                self._place_food(self.grid, grid_x, grid_y, Config.FOOD_RADIUS, Config.POSTFOOD_VALUE)
-            elif pygame.mouse.get_pressed()[2]:
-                # self.clear_chemotrails(grid_x, grid_y, Config.CLEAR_RADIUS)
-                self._clear_chemotrails(self.grid, grid_x, grid_y, Config.CLEAR_RADIUS)
-
-            # Update agents and grid
-            for agent in self.agents:
-                agent.sense_and_move(self.grid)
+            # Handle Pygame events
+            running = self._handle_input()
 
-            # Apply decay and diffusion
-            self._apply_decay_and_diffusion(self.grid, Config.DECAY, Config.DIFFUSION, Config.CELL_SIZE)
+            # Update agents, then apply decay and diffusion
+            self.step()
 
-            # Render the grid and agents
+            # Render the grid and the agents inside the viewport
             self.renderer.render(self.grid)
-            for agent in self.agents:
-                self.renderer.draw_agent(agent)
+            self.renderer.draw_agents(self.agents)
 
             pygame.display.update()  # Update the display
 
@@ -306,4 +612,3 @@ class PhysarumSimulation(Observer):
             clock.tick(Config.FRAMERATE)
 
         pygame.quit()
-
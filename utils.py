@@ -3,7 +3,7 @@ import numba
 import numpy as np
 
 # This is a helper function that can be used to interpolate between two RGB colors (must be moved outside of the class to work with Numba)
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def interpolate_color(color1, color2, factor):
     """ Interpolates between two RGB colors. """
     result = np.empty(3, dtype=np.int32)  # Use NumPy array for fixed-size sequence
@@ -11,7 +11,7 @@ def interpolate_color(color1, color2, factor):
         result[i] = int(color1[i] + (color2[i] - color1[i]) * factor)
     return result  # Return as NumPy array which is supported by Numba
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def color_from_value(value, max_trail_value):
     """
     Determine the color of a cell based on its value using the 'viridis' colormap.
@@ -40,3 +40,39 @@ def color_from_value(value, max_trail_value):
     return color
 
 
+
+def build_channel_luts(channels, colors, size=256):
+    """
+    Build one color lookup table per trail channel. Channel 0 uses the 'viridis'
+    colormap, the other channels ramp from black to their color in `colors`.
+    """
+    luts = np.zeros((channels, size, 3), dtype=np.int32)
+    ramp = np.linspace(0.0, 1.0, size)
+    for i in range(size):
+        luts[0, i] = color_from_value(ramp[i], 1.0)
+    for c in range(1, channels):
+        color = np.array(colors[c % len(colors)], dtype=np.float64)
+        luts[c] = (ramp[:, None] * color).astype(np.int32)
+    return luts
+
+@numba.jit(nopython=True, cache=True)
+def composite_channels(grid, luts, max_trail_value, out):
+    """
+    Colormap every channel of a (channels, width, height) grid through its lookup
+    table and add them up into the (width, height, 3) `out` image in a single pass.
+    """
+    size = luts.shape[1]
+    for i in range(out.shape[0]):
+        for j in range(out.shape[1]):
+            r = 0
+            g = 0
+            b = 0
+            for c in range(grid.shape[0]):
+                normalized_value = min(max(grid[c, i, j] / max_trail_value, 0.0), 1.0)
+                k = int(normalized_value * (size - 1))
+                r += luts[c, k, 0]
+                g += luts[c, k, 1]
+                b += luts[c, k, 2]
+            out[i, j, 0] = min(r, 255)
+            out[i, j, 1] = min(g, 255)
+            out[i, j, 2] = min(b, 255)
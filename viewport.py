@@ -0,0 +1,197 @@
+# viewport.py :
+import numba
+import numpy as np
+
+
+class Viewport:
+    """ Pan and zoom window over the grid, measured in grid cells. """
+    def __init__(self, screen_size, grid_size, zoom):
+        self.screen_size = screen_size
+        self.grid_size = grid_size
+        self.max_zoom = max(zoom, 1) * 4  # Screen pixels per cell when fully zoomed in
+        self.zoom = zoom  # Screen pixels per grid cell
+        self.x = 0.0  # Grid coordinates of the top-left corner of the screen
+        self.y = 0.0
+        self.reset()
+
+    @property
+    def min_zoom(self):
+        """ Zoom at which the whole grid fits on the screen. """
+        return min(self.screen_size[0] / self.grid_size[0], self.screen_size[1] / self.grid_size[1])
+
+    def reset(self):
+        """ Zoom out to the whole grid and center it on the screen. """
+        self.zoom = min(self.min_zoom, self.max_zoom)
+        self.x = (self.grid_size[0] - self.screen_size[0] / self.zoom) / 2
+        self.y = (self.grid_size[1] - self.screen_size[1] / self.zoom) / 2
+        self._clamp()
+
+    def pan(self, dx, dy):
+        """ Move the view by (dx, dy) screen pixels. """
+        self.x += dx / self.zoom
+        self.y += dy / self.zoom
+        self._clamp()
+
+    def zoom_at(self, factor, screen_x, screen_y):
+        """ Zoom by `factor` while keeping the grid point under the screen position fixed. """
+        grid_x = self.x + screen_x / self.zoom
+        grid_y = self.y + screen_y / self.zoom
+        self.zoom = max(min(self.zoom * factor, self.max_zoom), self.min_zoom)
+        self.x = grid_x - screen_x / self.zoom
+        self.y = grid_y - screen_y / self.zoom
+        self._clamp()
+
+    def screen_to_grid(self, screen_x, screen_y):
+        """ Grid cell under a screen position. """
+        grid_x = int(self.x + screen_x / self.zoom)
+        grid_y = int(self.y + screen_y / self.zoom)
+        return (min(max(grid_x, 0), self.grid_size[0] - 1), min(max(grid_y, 0), self.grid_size[1] - 1))
+
+    def grid_to_screen(self, grid_x, grid_y):
+        """ Screen position of grid coordinates, works element-wise on arrays. """
+        return (grid_x - self.x) * self.zoom, (grid_y - self.y) * self.zoom
+
+    def visible_rect(self):
+        """ Visible cells as (x0, y0, x1, y1), end exclusive and clipped to the grid. """
+        x0 = max(int(np.floor(self.x)), 0)
+        y0 = max(int(np.floor(self.y)), 0)
+        x1 = min(int(np.ceil(self.x + self.screen_size[0] / self.zoom)), self.grid_size[0])
+        y1 = min(int(np.ceil(self.y + self.screen_size[1] / self.zoom)), self.grid_size[1])
+        return x0, y0, x1, y1
+
+    def level(self, levels):
+        """ Coarsest mipmap level that still has at least one cell per screen pixel. """
+        if self.zoom >= 1:
+            return 0
+        return min(int(np.log2(1 / self.zoom)), levels - 1)
+
+    def _clamp(self):
+        # Keep the grid on screen, centering it along axes where it is smaller than the screen
+        for axis in range(2):
+            span = self.screen_size[axis] / self.zoom
+            size = self.grid_size[axis]
+            value = self.x if axis == 0 else self.y
+            value = (size - span) / 2 if span >= size else min(max(value, 0.0), size - span)
+            if axis == 0:
+                self.x = value
+            else:
+                self.y = value
+
+
+class MipPyramid:
+    """
+    Lazily maintained min/max/mean mipmap pyramid of a (channels, width, height) grid.
+    Level 0 is the grid itself, every further level halves both dimensions.
+
+    The grid is split into square blocks that are reduced independently, so a refresh
+    can be limited to the visible blocks and to a number of blocks per call, oldest
+    first. Levels coarser than a block are small and rebuilt whole from the block levels.
+    For memory-mapped grids the levels larger than a tile are memory-mapped files as well.
+    """
+    REDUCTIONS = ('min', 'max', 'mean')
+    BLOCK_SIZE = 128  # Size in grid cells of the blocks of in-memory grids, memory-mapped grids use their tiles
+
+    def __init__(self, grid):
+        channels, width, height = grid.shape
+        self.shape = grid.shape
+        self._levels = [None]
+        while width > 1 or height > 1:
+            width = (width + 1) // 2
+            height = (height + 1) // 2
+            self._levels.append(tuple(self._allocate(grid, len(self._levels), (channels, width, height))))
+        self.levels = len(self._levels)
+        self.set_grid(grid)
+
+    def _allocate(self, grid, n, shape):
+        """
+        Storage of level `n` for every reduction. A memory-mapped grid may not fit in memory and
+        neither would its finer levels, so levels larger than a tile are mapped to files next to it.
+        """
+        shape = (len(self.REDUCTIONS),) + shape
+        if isinstance(grid, np.ndarray) or shape[2] * shape[3] <= grid.tile_size ** 2:
+            return np.zeros(shape, dtype=np.float32)
+        return np.memmap(f'{grid.path}.lod{n}', dtype=np.float32, mode='w+', shape=shape)
+
+    def set_grid(self, grid):
+        """ Reuse the pyramid for another grid of the same shape, it is rebuilt on the next refresh. """
+        if grid.shape != self.shape:
+            raise ValueError(f'Expected a grid of shape {self.shape}, got {grid.shape}')
+        self.grid = grid
+        self._levels[0] = (grid, grid, grid)
+        self.block_size = self.BLOCK_SIZE if isinstance(grid, np.ndarray) else grid.tile_size
+        # Levels 1..block_levels are reduced block by block, every block halving evenly
+        self.block_levels = min((self.block_size & -self.block_size).bit_length() - 1, self.levels - 1)
+        blocks = (-(-self.shape[1] // self.block_size), -(-self.shape[2] // self.block_size))
+        self._version = 0
+        self._refreshed = np.full(blocks, -1, dtype=np.int64)  # Version each block was last reduced at, -1 if never
+        self._coarse_stale = True
+
+    def invalidate(self):
+        """ The whole grid changed, every block is rebuilt on the next refresh whatever the budget. """
+        self._refreshed[:] = -1
+
+    def mark_stale(self):
+        """ The grid kept changing, blocks are refreshed oldest first within the refresh budget. """
+        self._version += 1
+
+    def refresh(self, rect=None, budget=None):
+        """
+        Reduce the out of date blocks overlapping `rect` (x0, y0, x1, y1 in grid cells, the
+        whole grid if None), at most `budget` of them unless they were never built.
+        """
+        x0, y0, x1, y1 = rect or (0, 0, self.shape[1], self.shape[2])
+        size = self.block_size
+        bx0, by0 = x0 // size, y0 // size
+        bx1, by1 = -(-x1 // size), -(-y1 // size)
+        refreshed = self._refreshed[bx0:bx1, by0:by1]
+        xs, ys = np.nonzero(refreshed < self._version)
+        if budget is not None and len(xs) > budget:
+            # Oldest blocks first, blocks that were never built always go through
+            order = np.argsort(refreshed[xs, ys], kind='stable')
+            keep = max(budget, int(np.count_nonzero(refreshed[xs, ys] < 0)))
+            xs, ys = xs[order[:keep]], ys[order[:keep]]
+        for bx, by in zip(xs + bx0, ys + by0):
+            self._reduce_block(bx, by)
+            self._refreshed[bx, by] = self._version
+        self._coarse_stale |= len(xs) > 0
+
+    def _reduce_block(self, bx, by):
+        size = self.block_size
+        x0, y0 = bx * size, by * size
+        # Memory-mapped grids hand out a copy of the block, read from its tile
+        tile = self.grid[:, x0:x0 + size, y0:y0 + size]
+        sources = (tile, tile, tile)
+        for n in range(1, self.block_levels + 1):
+            scale = 2 ** n
+            region = (slice(None), slice(x0 // scale, (x0 + size) // scale), slice(y0 // scale, (y0 + size) // scale))
+            targets = tuple(level[region] for level in self._levels[n])
+            _reduce_level(*sources, *targets)
+            sources = targets
+
+    def level(self, n, reduction='mean'):
+        """ Return level `n` reduced with 'min', 'max' or 'mean', as of the last refresh. """
+        if n > self.block_levels and self._coarse_stale:
+            for m in range(self.block_levels + 1, self.levels):
+                _reduce_level(*self._levels[m - 1], *self._levels[m])
+            self._coarse_stale = False
+        return self._levels[n][self.REDUCTIONS.index(reduction)]
+
+
+@numba.jit(nopython=True, cache=True)
+def _reduce_level(src_min, src_max, src_mean, dst_min, dst_max, dst_mean):
+    """ Reduce 2x2 blocks of one pyramid level into the next one. """
+    # Cells past an odd edge repeat the last row or column, which leaves min, max and mean unchanged
+    width, height = src_mean.shape[1], src_mean.shape[2]
+    for c in range(dst_mean.shape[0]):
+        for i in range(dst_mean.shape[1]):
+            i0 = 2 * i
+            i1 = min(i0 + 1, width - 1)
+            for j in range(dst_mean.shape[2]):
+                j0 = 2 * j
+                j1 = min(j0 + 1, height - 1)
+                dst_min[c, i, j] = min(min(src_min[c, i0, j0], src_min[c, i1, j0]),
+                                       min(src_min[c, i0, j1], src_min[c, i1, j1]))
+                dst_max[c, i, j] = max(max(src_max[c, i0, j0], src_max[c, i1, j0]),
+                                       max(src_max[c, i0, j1], src_max[c, i1, j1]))
+                dst_mean[c, i, j] = 0.25 * (src_mean[c, i0, j0] + src_mean[c, i1, j0]
+                                            + src_mean[c, i0, j1] + src_mean[c, i1, j1])